@@ -0,0 +1,90 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from slugify import slugify
+from Logger import LoggerManager
+from PDFBuffer import PDFBuffer
+from PDFProcessor import PDFProcessor
+from image_text_extractor import save_pdf_page_as_image
+
+BACKFILL_STAGES = ('text', 'images')
+
+
+class BackfillRunner:
+    """
+    Reruns selected stages over already processed PDFs without touching their status.
+
+    PDFs are fetched from the GCS PDF bucket (the copy made at ingest), so the
+    original input folder or Drive file is not needed. 'text' refreshes
+    extracted_text in place; 'images' re-renders and repoints the existing
+    page rows, reusing deduplicated images where possible.
+    """
+
+    def __init__(self, db_manager, gcs_manager, temp_path=None, max_workers=8, dpi=100, batch_size=100):
+        self.logger = LoggerManager().get_logger(self.__class__.__name__)
+        self.db_manager = db_manager
+        self.gcs_manager = gcs_manager
+        self.temp_path = temp_path
+        self.max_workers = max_workers
+        self.dpi = dpi
+        self.batch_size = batch_size
+
+    def _backfill_pdf(self, pdf, stages, pdf_processor):
+        blob_name = self.gcs_manager.pdf_blob_name_from_url(pdf.pdf_public_url)
+        upload_pdf_file_name = slugify(pdf.pdf_file_name)[:50]
+
+        with tempfile.TemporaryDirectory(dir=self.temp_path) as work_dir:
+            pdf_path = os.path.join(work_dir, pdf.pdf_file_name)
+            self.gcs_manager.download_pdf(blob_name, pdf_path)
+
+            with PDFBuffer(pdf_path) as pdf_buffer:
+                if 'images' in stages:
+                    for image_batch in save_pdf_page_as_image(
+                            pdf_path, dpi=self.dpi, batch_size=self.batch_size, page_count=pdf_buffer.page_count):
+                        pdf_processor.process_image_batch(
+                            image_batch, upload_pdf_file_name, pdf.pdf_file_id, replace_existing=True)
+
+                if 'text' in stages:
+                    pdf_processor.stream_page_texts(pdf_path, pdf.pdf_file_id, pdf_buffer=pdf_buffer)
+
+    def run(self, stages, pdf_file_names=None, status='done', limit=None):
+        """
+        Args:
+            stages (iterable of str): Subset of BACKFILL_STAGES to rerun.
+            pdf_file_names (list of str, optional): PDFs to backfill, default all with status.
+            status (str, optional): Only PDFs in this status; None for any.
+            limit (int, optional): Maximum number of PDFs.
+
+        Returns:
+            tuple: (number succeeded, list of failed pdf_file_name)
+        """
+        stages = set(stages)
+        unknown = stages - set(BACKFILL_STAGES)
+        if unknown or not stages:
+            raise ValueError(f"Unknown or empty backfill stages {sorted(unknown)}, choose from {BACKFILL_STAGES}")
+
+        pdfs = self.db_manager.get_pdfs_for_backfill(pdf_file_names=pdf_file_names, status=status, limit=limit)
+        self.logger.info(f"Backfilling stages {sorted(stages)} for {len(pdfs)} PDFs.")
+
+        succeeded = 0
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="backfill") as pdf_executor, \
+                ThreadPoolExecutor(max_workers=9, thread_name_prefix="image") as image_executor, \
+                ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="text") as text_executor:
+            pdf_processor = PDFProcessor(
+                self.db_manager, self.gcs_manager, image_executor=image_executor, text_executor=text_executor)
+            futures = {
+                pdf_executor.submit(self._backfill_pdf, pdf, stages, pdf_processor): pdf for pdf in pdfs
+            }
+            for future in as_completed(futures):
+                pdf = futures[future]
+                try:
+                    future.result()
+                    succeeded += 1
+                    self.logger.info(f"Backfill completed for PDF: {pdf.pdf_file_name}")
+                except Exception as e:
+                    failed.append(pdf.pdf_file_name)
+                    self.logger.error(f"Backfill failed for PDF {pdf.pdf_file_name}: {e}")
+
+        self.logger.info(f"Backfill finished: {succeeded} succeeded, {len(failed)} failed.")
+        return succeeded, failed
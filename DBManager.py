@@ -1,20 +1,54 @@
-from sqlalchemy import create_engine, Column, String, ForeignKey, UUID, JSON, func, DateTime, TEXT, Integer, Boolean
+from sqlalchemy import create_engine, Column, String, ForeignKey, UUID, JSON, func, DateTime, TEXT, Integer, BigInteger, Boolean, Computed, Index, text, Float, cast, update, bindparam
+from sqlalchemy.dialects.postgresql import TSVECTOR, JSONB, aggregate_order_by, insert as pg_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.types import TypeDecorator
 import os
 import uuid
 from slugify import slugify
-from sqlalchemy import desc
+from sqlalchemy import desc, event, select, or_, and_, case
 from Logger import LoggerManager
 import time
+import threading
+import itertools
+import json
 from image_text_extractor import count_pdf_pages
 
 Base = declarative_base()
 
 
+class JSONBFromText(TypeDecorator):
+    """
+    JSONB that also accepts JSON text: str values are parsed before binding, so
+    writers that assign json.dumps(...) store the document, not a JSON string.
+    Strings that are not valid JSON are stored as JSON strings.
+    """
+    impl = JSONB
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            try:
+                return json.loads(value)
+            except ValueError:
+                return value
+        return value
+
+# Text search configuration used both for the stored tsvector and for queries,
+# they must match for the GIN index to be used.
+TEXT_SEARCH_CONFIG = 'english'
+
+# Channel notified with the pdf_file_id whenever a datasheet_files row becomes Pending
+PENDING_NOTIFY_CHANNEL = 'datasheet_files_pending'
+
+
 class PDFFile(Base):
     __tablename__ = 'datasheet_files'
-    __table_args__ = {'schema': 'chatmro_db'}
+    __table_args__ = (
+        Index('ix_datasheet_files_jsonify_json', 'jsonify_json',
+              postgresql_using='gin', postgresql_ops={'jsonify_json': 'jsonb_path_ops'}),
+        {'schema': 'chatmro_db'},
+    )
 
     pdf_file_id = Column(UUID(as_uuid=True),
                          primary_key=True, default=uuid.uuid4)
@@ -27,24 +61,46 @@ class PDFFile(Base):
     is_series_specific = Column(Boolean, nullable=True)
     has_mpn_builder = Column(Boolean, nullable=True)
     extra_tags = Column(TEXT)
+    # Large payloads, see PAYLOAD_COLUMNS
     tagger_raw_response = Column(TEXT)
     tagger_error = Column(Integer, default=0)
     jsonify_raw_response = Column(TEXT)
-    jsonify_json = Column(TEXT)
+    jsonify_json = Column(JSONBFromText)
     jsonify_error = Column(Integer, default=0)
     pd_ext_raw_response = Column(TEXT)
     pd_ext_list = Column(TEXT)
     pd_ext_error = Column(Integer, default=0)
     total_pages = Column(Integer, nullable=True)
+    pdf_file_size = Column(BigInteger, nullable=True)
+    # Higher runs sooner, see DBManager.claim_pending_pdfs
+    priority = Column(Integer, default=0, server_default='0', nullable=False)
+    # Incremented on each claim, see DBManager.claim_pending_pdfs
+    processing_attempts = Column(Integer, default=0, server_default='0', nullable=False)
     created_at = Column(DateTime, server_default=func.now())
     status = Column(String, default='Pending')
     last_changed_at = Column(
         DateTime, server_default=func.now(), onupdate=func.now())
 
 
+# Stored out of line (see DBManager.ensure_payload_storage). The pipeline's
+# status lookups select only the columns they return so these are never fetched.
+PAYLOAD_COLUMNS = (
+    PDFFile.tagger_raw_response,
+    PDFFile.jsonify_raw_response,
+    PDFFile.jsonify_json,
+    PDFFile.pd_ext_raw_response,
+)
+
+
 class ImageFile(Base):
     __tablename__ = 'datasheet_image_files'
-    __table_args__ = {'schema': 'chatmro_db'}
+    __table_args__ = (
+        Index('ix_datasheet_image_files_search_vector',
+              'search_vector', postgresql_using='gin'),
+        # Per-page lookups (text batches, page replacement) match on these two
+        Index('ix_datasheet_image_files_pdf_order', 'pdf_file_id', 'image_file_order'),
+        {'schema': 'chatmro_db'},
+    )
     image_file_id = Column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     pdf_file_id = Column(UUID(as_uuid=True), ForeignKey(
@@ -53,19 +109,73 @@ class ImageFile(Base):
     image_file_name = Column(String, nullable=False)
     image_public_uri = Column(String)
     extracted_text = Column(String)
+    # Maintained by Postgres whenever extracted_text is written
+    search_vector = Column(TSVECTOR, Computed(
+        f"to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(extracted_text, ''))", persisted=True))
     text_status = Column(String, default="Pending")
+    # Rendered-page hash shared with identical pages of other PDFs, see PageImageBlob
+    content_hash = Column(String(64), nullable=True, index=True)
     created_at = Column(DateTime, server_default=func.now())
 
 
+class PageImageBlob(Base):
+    """One uploaded page image per distinct rendered content, referenced by ImageFile.content_hash."""
+    __tablename__ = 'datasheet_page_image_blobs'
+    __table_args__ = {'schema': 'chatmro_db'}
+
+    content_hash = Column(String(64), primary_key=True)
+    image_public_uri = Column(String, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class DriveSyncState(Base):
+    __tablename__ = 'drive_sync_state'
+    __table_args__ = {'schema': 'chatmro_db'}
+
+    drive_folder_id = Column(String, primary_key=True)
+    page_token = Column(String, nullable=False)
+    last_changed_at = Column(
+        DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class DriveSyncRetry(Base):
+    """Drive files a sync found but could not ingest, retried by later syncs up to a limit."""
+    __tablename__ = 'drive_sync_retries'
+    __table_args__ = {'schema': 'chatmro_db'}
+
+    drive_folder_id = Column(String, primary_key=True)
+    drive_file_id = Column(String, primary_key=True)
+    file_name = Column(String, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_changed_at = Column(
+        DateTime, server_default=func.now(), onupdate=func.now())
+
+
 class DBManager:
 
-    def __init__(self, db_url, max_allowed_page):
+    def __init__(self, db_url, max_allowed_page, replica_urls=None, max_replica_lag=30, lag_check_interval=5):
         self.db_url = db_url
         self.max_allowed_page = max_allowed_page
         self.logger = LoggerManager().get_logger(self.__class__.__name__)
         self.engine = None
         self.Session = None
+        # Optional read replicas, used by get_read_session for read-only queries
+        self.replica_urls = list(replica_urls or [])
+        self.max_replica_lag = max_replica_lag
+        self.lag_check_interval = lag_check_interval
+        self.replica_sessions = []
+        self._replica_cycle = None
+        self._replica_state_cache = {}
+        self._replica_lock = threading.Lock()
+        # Replica forced re-checks, at most one per lag_check_interval each
+        self._replica_forced_at = {}
+        # Highest primary WAL position after one of this process's commits, 0 before any write
+        self._write_lsn = 0
+        # Set when a commit position could not be read; reads stay on the primary until then
+        self._primary_until = 0.0
         self.initialize_db()
+        self.initialize_replicas()
 
     def initialize_db(self, max_retries=4, wait_time=2):
         _retry = 0
@@ -80,7 +190,17 @@ class DBManager:
                     pool_pre_ping=True  # Enable pre-ping to check and maintain connections
                 )
                 Base.metadata.create_all(self.engine)
+                self.ensure_search_index()
+                self.ensure_pending_notify_trigger()
+                self.ensure_claim_columns()
+                self.ensure_scheduling_columns()
+                self.ensure_page_dedup_columns()
+                self.ensure_page_order_index()
+                self.ensure_payload_storage()
                 self.Session = sessionmaker(bind=self.engine)
+                event.listen(self.engine, 'before_cursor_execute', self._record_write)
+                event.listen(self.engine, 'commit', self._record_commit)
+                event.listen(self.engine.pool, 'checkin', self._capture_commit_lsn)
                 self.logger.info(
                     "Database connection established successfully.")
                 break  # Exit the loop if successful
@@ -95,6 +215,316 @@ class DBManager:
                         "Max retry attempts reached. Unable to establish database connection.")
                     raise Exception("Database connection failed")
 
+    def initialize_replicas(self):
+        """Creates engines for the replica URLs; no DDL is run against replicas."""
+        self.replica_sessions = []
+        for replica_url in self.replica_urls:
+            replica_engine = create_engine(
+                replica_url,
+                pool_size=5,
+                max_overflow=10,
+                pool_timeout=30,
+                pool_recycle=1800,
+                pool_pre_ping=True
+            )
+            self.replica_sessions.append(sessionmaker(bind=replica_engine))
+        self._replica_cycle = itertools.cycle(range(len(self.replica_sessions)))
+        if self.replica_sessions:
+            self.logger.info(f"Configured {len(self.replica_sessions)} read replica(s).")
+
+    def _record_write(self, conn, cursor, statement, parameters, context, executemany):
+        # Anything but a plain SELECT on the primary counts as a write for read-after-write routing
+        if statement.lstrip()[:6].upper() != 'SELECT':
+            conn.info['wal_write'] = True
+
+    def _record_commit(self, conn):
+        # The commit's WAL position is only final after COMMIT; it is read at checkin
+        if conn.info.pop('wal_write', False):
+            conn.info['wal_commit'] = True
+
+    def _capture_commit_lsn(self, dbapi_connection, connection_record):
+        """
+        Pool checkin hook: after a connection that committed a write is returned,
+        reads pg_current_wal_insert_lsn() on it once, which is past that commit
+        record. get_read_session gates replicas on the highest value seen.
+        """
+        info = connection_record.info
+        committed = info.pop('wal_commit', False)
+        # Writes that were rolled back never reach the WAL as commits
+        info.pop('wal_write', None)
+        if not committed:
+            return
+
+        lsn = None
+        if dbapi_connection is not None:
+            try:
+                cursor = dbapi_connection.cursor()
+                try:
+                    cursor.execute("SELECT pg_current_wal_insert_lsn()")
+                    lsn = self._parse_lsn(cursor.fetchone()[0])
+                finally:
+                    cursor.close()
+                # Don't leave the SELECT's transaction open in the pool
+                dbapi_connection.rollback()
+            except Exception as e:
+                self.logger.warning(f"Could not read the WAL position of a commit: {e}")
+
+        with self._replica_lock:
+            if lsn is None:
+                # Position unknown: any replica within max_replica_lag has it after that long
+                self._primary_until = time.monotonic() + self.max_replica_lag
+            elif lsn > self._write_lsn:
+                self._write_lsn = lsn
+
+    @staticmethod
+    def _parse_lsn(lsn):
+        """'16/B374D848' -> comparable int; None stays None."""
+        if lsn is None:
+            return None
+        high, low = str(lsn).split('/')
+        return (int(high, 16) << 32) | int(low, 16)
+
+    def _replica_state(self, index, refresh=False):
+        """
+        (replay_lsn, lag_seconds) of a replica, cached for lag_check_interval;
+        None if unreachable. refresh re-checks a cached entry early, at most
+        once per lag_check_interval per replica.
+        """
+        now = time.monotonic()
+        with self._replica_lock:
+            cached = self._replica_state_cache.get(index)
+            if cached and now - cached[0] < self.lag_check_interval:
+                forced_at = self._replica_forced_at.get(index)
+                if not refresh or (forced_at is not None and now - forced_at < self.lag_check_interval):
+                    return cached[1]
+                self._replica_forced_at[index] = now
+
+        session = self.replica_sessions[index]()
+        try:
+            replay_lsn, lag = session.execute(text(
+                "SELECT pg_last_wal_replay_lsn(), "
+                # Staleness only; an idle primary leaves the replay timestamp old with nothing to replay
+                "CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+            )).one()
+            state = (self._parse_lsn(replay_lsn), float(lag))
+        except Exception as e:
+            self.logger.warning(f"Could not check replica {index}: {e}")
+            state = None
+        finally:
+            session.close()
+
+        with self._replica_lock:
+            self._replica_state_cache[index] = (now, state)
+        return state
+
+    def get_read_session(self):
+        """
+        Returns a session for read-only queries.
+
+        Goes to a replica (round robin) when one is configured, its last replay
+        is no older than max_replica_lag, and it has replayed the primary WAL up
+        to this process's latest commit (captured when the writing connection
+        was checked in). Otherwise falls back to the primary. No primary round
+        trip is made to decide.
+        """
+        if not self.replica_sessions:
+            return self.get_new_session()
+
+        with self._replica_lock:
+            required_lsn = self._write_lsn
+            primary_only = time.monotonic() < self._primary_until
+        if primary_only:
+            return self.get_new_session()
+
+        for _ in range(len(self.replica_sessions)):
+            with self._replica_lock:
+                index = next(self._replica_cycle)
+            state = self._replica_state(index)
+            if state is not None and required_lsn and (state[0] is None or state[0] < required_lsn):
+                # The cached position may predate our commit; re-check if not done recently
+                state = self._replica_state(index, refresh=True)
+            if state is None:
+                continue
+            replay_lsn, lag = state
+            if lag > self.max_replica_lag:
+                continue
+            if required_lsn and (replay_lsn is None or replay_lsn < required_lsn):
+                # Our latest commit has not replayed there yet
+                continue
+            return self.replica_sessions[index]()
+
+        self.logger.info("No replica is fresh enough, reading from the primary.")
+        return self.get_new_session()
+
+    @staticmethod
+    def _missing_columns(conn, table_name, column_names):
+        """Returns which of column_names are not yet on chatmro_db.table_name, without locking it."""
+        existing = conn.execute(text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = 'chatmro_db' AND table_name = :table_name"
+        ), {'table_name': table_name}).scalars().all()
+        return [column for column in column_names if column not in existing]
+
+    @staticmethod
+    def _relation_exists(conn, qualified_name):
+        return conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': qualified_name}).scalar()
+
+    # The ensure_* methods run on every startup; ALTER TABLE / CREATE INDEX take
+    # table locks before checking IF NOT EXISTS, so each checks the catalog first
+    # and only issues DDL when there is something to change.
+
+    def ensure_search_index(self):
+        """Adds the full-text column and GIN index to tables created before they existed."""
+        with self.engine.begin() as conn:
+            if self._missing_columns(conn, 'datasheet_image_files', ['search_vector']):
+                conn.execute(text(
+                    "ALTER TABLE chatmro_db.datasheet_image_files "
+                    "ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                    f"GENERATED ALWAYS AS (to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(extracted_text, ''))) STORED"))
+            if not self._relation_exists(conn, 'chatmro_db.ix_datasheet_image_files_search_vector'):
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_datasheet_image_files_search_vector "
+                    "ON chatmro_db.datasheet_image_files USING gin (search_vector)"))
+
+    def ensure_pending_notify_trigger(self):
+        """Installs the trigger that NOTIFYs listeners when a PDF becomes Pending."""
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+                CREATE OR REPLACE FUNCTION chatmro_db.notify_pdf_pending() RETURNS trigger AS $$
+                BEGIN
+                    IF NEW.status = 'Pending' AND (TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM NEW.status) THEN
+                        PERFORM pg_notify('{PENDING_NOTIFY_CHANNEL}', NEW.pdf_file_id::text);
+                    END IF;
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql
+            """))
+            # CREATE TRIGGER locks the table, so only run it when the trigger is missing
+            trigger_exists = conn.execute(text(
+                "SELECT EXISTS (SELECT 1 FROM pg_trigger "
+                "WHERE tgname = 'datasheet_files_pending_notify' "
+                "AND tgrelid = 'chatmro_db.datasheet_files'::regclass)"
+            )).scalar()
+            if not trigger_exists:
+                conn.execute(text(
+                    "CREATE TRIGGER datasheet_files_pending_notify "
+                    "AFTER INSERT OR UPDATE OF status ON chatmro_db.datasheet_files "
+                    "FOR EACH ROW EXECUTE FUNCTION chatmro_db.notify_pdf_pending()"))
+
+    def ensure_claim_columns(self):
+        """Adds the claim attempt counter to existing datasheet_files tables."""
+        with self.engine.begin() as conn:
+            if self._missing_columns(conn, 'datasheet_files', ['processing_attempts']):
+                conn.execute(text(
+                    "ALTER TABLE chatmro_db.datasheet_files "
+                    "ADD COLUMN IF NOT EXISTS processing_attempts INTEGER NOT NULL DEFAULT 0"))
+
+    def ensure_scheduling_columns(self):
+        """Adds the columns used by the pending-queue scheduler to existing tables."""
+        with self.engine.begin() as conn:
+            missing = self._missing_columns(conn, 'datasheet_files', ['pdf_file_size', 'priority'])
+            if 'pdf_file_size' in missing:
+                conn.execute(text(
+                    "ALTER TABLE chatmro_db.datasheet_files "
+                    "ADD COLUMN IF NOT EXISTS pdf_file_size BIGINT"))
+            if 'priority' in missing:
+                conn.execute(text(
+                    "ALTER TABLE chatmro_db.datasheet_files "
+                    "ADD COLUMN IF NOT EXISTS priority INTEGER NOT NULL DEFAULT 0"))
+
+    def ensure_page_dedup_columns(self):
+        """Adds the page content hash column and its index to existing datasheet_image_files tables."""
+        with self.engine.begin() as conn:
+            if self._missing_columns(conn, 'datasheet_image_files', ['content_hash']):
+                conn.execute(text(
+                    "ALTER TABLE chatmro_db.datasheet_image_files "
+                    "ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"))
+            if not self._relation_exists(conn, 'chatmro_db.ix_chatmro_db_datasheet_image_files_content_hash'):
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_chatmro_db_datasheet_image_files_content_hash "
+                    "ON chatmro_db.datasheet_image_files (content_hash)"))
+
+    def ensure_page_order_index(self):
+        """Adds the (pdf_file_id, image_file_order) index to existing datasheet_image_files tables."""
+        with self.engine.begin() as conn:
+            if not self._relation_exists(conn, 'chatmro_db.ix_datasheet_image_files_pdf_order'):
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_datasheet_image_files_pdf_order "
+                    "ON chatmro_db.datasheet_image_files (pdf_file_id, image_file_order)"))
+
+    def ensure_payload_storage(self):
+        """
+        Keeps the raw-response payloads out of the hot datasheet_files heap rows.
+
+        Converts jsonify_json to JSONB with a GIN index (values that are not
+        valid JSON are kept as JSON strings) and asks Postgres to TOAST the
+        payload columns out of line, lz4-compressed where the server supports it.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                CREATE OR REPLACE FUNCTION chatmro_db.text_to_jsonb(value text) RETURNS jsonb AS $$
+                BEGIN
+                    RETURN value::jsonb;
+                EXCEPTION WHEN others THEN
+                    RETURN to_jsonb(value);
+                END;
+                $$ LANGUAGE plpgsql IMMUTABLE
+            """))
+            conn.execute(text("""
+                DO $$
+                BEGIN
+                    IF (SELECT data_type FROM information_schema.columns
+                        WHERE table_schema = 'chatmro_db' AND table_name = 'datasheet_files'
+                          AND column_name = 'jsonify_json') = 'text' THEN
+                        ALTER TABLE chatmro_db.datasheet_files
+                            ALTER COLUMN jsonify_json TYPE jsonb USING chatmro_db.text_to_jsonb(jsonify_json);
+                    END IF;
+                END
+                $$
+            """))
+            if not self._relation_exists(conn, 'chatmro_db.ix_datasheet_files_jsonify_json'):
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_datasheet_files_jsonify_json "
+                    "ON chatmro_db.datasheet_files USING gin (jsonify_json jsonb_path_ops)"))
+            reloptions = conn.execute(text(
+                "SELECT reloptions FROM pg_class WHERE oid = 'chatmro_db.datasheet_files'::regclass"
+            )).scalar() or []
+            if 'toast_tuple_target=256' not in reloptions:
+                # Move anything over ~256 bytes of the row into TOAST instead of the heap tuple
+                conn.execute(text(
+                    "ALTER TABLE chatmro_db.datasheet_files SET (toast_tuple_target = 256)"))
+
+        payload_columns = [column.key for column in PAYLOAD_COLUMNS]
+        try:
+            with self.engine.begin() as conn:
+                # attcompression is 'l' once lz4 is set (column only exists on Postgres 14+)
+                uncompressed = conn.execute(text(
+                    "SELECT attname FROM pg_attribute "
+                    "WHERE attrelid = 'chatmro_db.datasheet_files'::regclass "
+                    "AND attname = ANY(:columns) AND attcompression <> 'l'"
+                ), {'columns': payload_columns}).scalars().all()
+                for column in uncompressed:
+                    conn.execute(text(
+                        f"ALTER TABLE chatmro_db.datasheet_files ALTER COLUMN {column} SET COMPRESSION lz4"))
+        except Exception as e:
+            # Needs Postgres 14+ built with lz4; pglz compression still applies otherwise
+            self.logger.warning(f"lz4 compression not available for payload columns: {e}")
+
+    def listen_connection(self, channel=PENDING_NOTIFY_CHANNEL):
+        """
+        Returns a dedicated autocommit DBAPI connection LISTENing on channel.
+        It is detached from the pool, the caller owns and closes it.
+        """
+        raw_connection = self.engine.raw_connection()
+        raw_connection.detach()
+        connection = raw_connection.driver_connection
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {channel}")
+        self.logger.info(f"Listening for notifications on '{channel}'.")
+        return connection
+
     def get_new_session(self):
         """Always returns a new session, reinitializing the DB connection if needed."""
         self.logger.info("Creating a new session.")
@@ -107,9 +537,9 @@ class DBManager:
             self.initialize_db()
             return self.Session()
 
-    def insert_pdf_files(self, filename, pdf_file_path, pdf_public_url,pdf_gdrive_url=None):
+    def insert_pdf_files(self, filename, pdf_file_path, pdf_public_url,pdf_gdrive_url=None, pdf_buffer=None):
         session = self.get_new_session()
-        existing_file = session.query(PDFFile).filter_by(
+        existing_file = session.query(PDFFile.pdf_file_id).filter_by(
             pdf_file_path=pdf_file_path).first()
         pdf_file_name = filename  # os.path.basename(pdf_file_path)
         slug_value = slugify(pdf_file_name)[:50]
@@ -118,7 +548,7 @@ class DBManager:
             self.logger.info(
                 f"File '{pdf_file_path}' already exists, skipping insert.")
             return
-        total_pages = count_pdf_pages(pdf_file_path)
+        total_pages = pdf_buffer.page_count if pdf_buffer is not None else count_pdf_pages(pdf_file_path)
         status = 'failed' if total_pages is not None and total_pages > self.max_allowed_page else 'Pending'
         pdf_file = PDFFile(
             pdf_file_name=pdf_file_name,
@@ -126,6 +556,7 @@ class DBManager:
             pdf_file_path=pdf_gdrive_url if pdf_gdrive_url else pdf_file_path,
             pdf_public_url=pdf_public_url,
             total_pages=total_pages,
+            pdf_file_size=pdf_buffer.size if pdf_buffer is not None else os.path.getsize(pdf_file_path),
             status=status
         )
         session.add(pdf_file)
@@ -137,21 +568,93 @@ class DBManager:
         # print("PDF files inserted successfully.")
         self.logger.info("PDF files inserted successfully.")
 
-    def insert_image_record(self, pdf_uuid, image_file_name, image_file_order, public_uri):
+    def insert_image_record(self, pdf_uuid, image_file_name, image_file_order, public_uri, content_hash=None):
         session = self.get_new_session()
         image_record = ImageFile(
             image_file_id=str(uuid.uuid4()),  # Generate a new UUID
             pdf_file_id=pdf_uuid,
             image_file_name=image_file_name,
             image_file_order=image_file_order,
-            image_public_uri=public_uri
+            image_public_uri=public_uri,
+            content_hash=content_hash
         )
         session.add(image_record)
+        if content_hash:
+            # Register the blob on first use and count the reference in the same transaction
+            blob_table = PageImageBlob.__table__
+            stmt = pg_insert(blob_table).values(
+                content_hash=content_hash, image_public_uri=public_uri, ref_count=1)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[blob_table.c.content_hash],
+                set_={'ref_count': blob_table.c.ref_count + 1})
+            session.execute(stmt)
         session.commit()
         session.close()
         # print(f"Inserted image record for: {image_file_name}")
         self.logger.info(f"Inserted image record for: {image_file_name}")
 
+    def replace_image_record(self, pdf_uuid, image_file_name, image_file_order, public_uri, content_hash=None):
+        """
+        Points an existing page row at a new image, inserting it if missing, and
+        moves the blob reference from the old content hash to the new one.
+
+        The page row is repointed by one indexed UPDATE that returns the old
+        hash; blob counts are only touched when the hash actually changed.
+        """
+        image_table = ImageFile.__table__
+        blob_table = PageImageBlob.__table__
+        old = (
+            select(image_table.c.image_file_id, image_table.c.content_hash)
+            .where(image_table.c.pdf_file_id == pdf_uuid)
+            .where(image_table.c.image_file_order == image_file_order)
+            .with_for_update()
+            .subquery('old')
+        )
+        stmt = (
+            update(image_table)
+            .where(image_table.c.image_file_id == old.c.image_file_id)
+            .values(image_file_name=image_file_name, image_public_uri=public_uri, content_hash=content_hash)
+            .returning(old.c.content_hash)
+        )
+
+        session = self.get_new_session()
+        try:
+            old_hashes = session.execute(stmt).scalars().all()
+            if not old_hashes:
+                session.rollback()
+            else:
+                changed = [old_hash for old_hash in old_hashes if old_hash != content_hash]
+                for old_hash in changed:
+                    if old_hash:
+                        session.execute(
+                            update(blob_table)
+                            .where(blob_table.c.content_hash == old_hash)
+                            .values(ref_count=blob_table.c.ref_count - 1))
+                if content_hash and changed:
+                    stmt = pg_insert(blob_table).values(
+                        content_hash=content_hash, image_public_uri=public_uri, ref_count=len(changed))
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[blob_table.c.content_hash],
+                        set_={'ref_count': blob_table.c.ref_count + len(changed)})
+                    session.execute(stmt)
+                session.commit()
+                self.logger.info(f"Replaced image record for: {image_file_name}")
+        finally:
+            session.close()
+
+        if not old_hashes:
+            self.insert_image_record(
+                pdf_uuid, image_file_name, image_file_order, public_uri, content_hash=content_hash)
+
+    def get_page_image_uri(self, content_hash):
+        """Returns the public URI of an already uploaded page image with this content hash, if any."""
+        session = self.get_new_session()
+        try:
+            blob = session.get(PageImageBlob, content_hash)
+            return blob.image_public_uri if blob else None
+        finally:
+            session.close()
+
     def update_extracted_text(self, image_uuid, text):
         session = self.get_new_session()
         image_record = session.query(ImageFile).filter_by(
@@ -169,15 +672,49 @@ class DBManager:
         session.commit()
         session.close()
 
+    def update_extracted_texts(self, pdf_uuid, page_texts):
+        """
+        Writes extracted text for many pages of one PDF in a single executemany.
+
+        Args:
+            pdf_uuid: The parent PDF's id.
+            page_texts (list of PageText): Pages to update, matched on image_file_order.
+        """
+        if not page_texts:
+            return
+        image_table = ImageFile.__table__
+        stmt = (
+            update(image_table)
+            .where(image_table.c.pdf_file_id == bindparam('b_pdf_file_id'))
+            .where(image_table.c.image_file_order == bindparam('b_image_file_order'))
+            .values(extracted_text=bindparam('b_extracted_text'), text_status='done')
+        )
+        params = [
+            {
+                'b_pdf_file_id': pdf_uuid,
+                'b_image_file_order': page.page_index,
+                'b_extracted_text': page.text,
+            }
+            for page in page_texts
+        ]
+        session = self.get_new_session()
+        try:
+            session.execute(stmt, params)
+            session.commit()
+        finally:
+            session.close()
+        self.logger.info(
+            f"Updated extracted text for {len(params)} pages of pdf uuid- {pdf_uuid}")
+
     def update_pdf_status(self, pdf_uuid):
         session = self.get_new_session()
-        query = session.query(PDFFile)
         if pdf_uuid:
-            pdf_record = query.filter_by(pdf_file_id=pdf_uuid).first()
-        if pdf_record:
-            pdf_record.status = 'done'
-            self.logger.info(
-                f"updating pdf status to done- pdf uuid- {pdf_uuid}")
+            # Plain UPDATE so the wide payload columns are never loaded
+            updated = session.query(PDFFile).filter_by(pdf_file_id=pdf_uuid).update(
+                {PDFFile.status: 'done'}, synchronize_session=False)
+            if updated:
+                self.logger.info(
+                    f"updating pdf status to done- pdf uuid- {pdf_uuid}")
         session.commit()
         session.close()
 
@@ -194,21 +731,316 @@ class DBManager:
         session.close()
         return pending_pdfs
 
-    def get_all_pdf_filenames(self):
+    @staticmethod
+    def _schedule_cost(mb_weight=0.5, aging_seconds=60, priority_weight=100):
+        """
+        SQL cost expression of the shortest-job-first schedule, lower runs first.
+
+        A PDF's cost is its page count plus mb_weight per MB of file size. Every
+        aging_seconds spent waiting takes one unit off the cost, so large
+        documents still reach the head of the queue, and each priority point
+        is worth priority_weight units. Built over the table columns so it can
+        be used in both the claim's ORDER BY and its RETURNING.
+        """
+        pdf_table = PDFFile.__table__
+        waited_seconds = func.extract('epoch', func.now() - pdf_table.c.created_at)
+        return (
+            cast(func.coalesce(pdf_table.c.total_pages, 1), Float)
+            + func.coalesce(pdf_table.c.pdf_file_size, 0) / (1024.0 * 1024.0) * mb_weight
+            - waited_seconds / aging_seconds
+            - pdf_table.c.priority * priority_weight
+        )
+
+    def claim_pending_pdfs(self, limit=None, pdf_file_names=None, retry_seconds=600, lease_seconds=3600,
+                           max_attempts=3, mb_weight=0.5, aging_seconds=60, priority_weight=100):
+        """
+        Atomically moves the next Pending PDFs to 'Processing' and returns them,
+        so concurrent workers and one-shot runs never process the same row.
+
+        Rows are taken in schedule order with FOR UPDATE SKIP LOCKED. A row that
+        already failed (processing_attempts > 0) waits retry_seconds after its
+        release, and a 'Processing' row untouched for lease_seconds (its worker
+        died) is claimed again. Every claim increments processing_attempts. A
+        lease-expired row that already used max_attempts claims is marked
+        'failed' instead, so a PDF that kills its worker is not retried forever.
+
+        Args:
+            limit (int): Claim at most this many rows.
+            pdf_file_names (list of str, optional): Only claim among these files.
+            max_attempts (int): Same limit the caller passes to release_pdf_claims.
+
+        Returns:
+            list of rows with pdf_file_id, pdf_file_name, pdf_file_path, total_pages,
+            pdf_file_size, created_at and schedule_cost, in schedule order.
+        """
+        lease_expired = and_(
+            PDFFile.status == 'Processing',
+            PDFFile.last_changed_at < func.now() - func.make_interval(0, 0, 0, 0, 0, 0, lease_seconds),
+        )
+        claimable = or_(
+            and_(
+                PDFFile.status == 'Pending',
+                or_(
+                    PDFFile.processing_attempts == 0,
+                    PDFFile.last_changed_at < func.now() - func.make_interval(0, 0, 0, 0, 0, 0, retry_seconds),
+                ),
+            ),
+            and_(lease_expired, PDFFile.processing_attempts < max_attempts),
+        )
+        cost = self._schedule_cost(mb_weight, aging_seconds, priority_weight)
+        candidates = (
+            select(PDFFile.pdf_file_id)
+            .where(claimable)
+            .order_by(cost, PDFFile.created_at)
+            .with_for_update(skip_locked=True)
+        )
+        if pdf_file_names is not None:
+            candidates = candidates.where(PDFFile.pdf_file_name.in_(list(pdf_file_names)))
+        if limit is not None:
+            candidates = candidates.limit(limit)
+
+        pdf_table = PDFFile.__table__
+        # Rows whose worker died on every attempt (e.g. killed while rendering)
+        exhausted = (
+            select(PDFFile.pdf_file_id)
+            .where(lease_expired, PDFFile.processing_attempts >= max_attempts)
+            .with_for_update(skip_locked=True)
+        )
+        fail_exhausted = (
+            update(pdf_table)
+            .where(pdf_table.c.pdf_file_id.in_(exhausted.scalar_subquery()))
+            .values(status='failed', last_changed_at=func.now())
+            .returning(pdf_table.c.pdf_file_name)
+        )
+        stmt = (
+            update(pdf_table)
+            .where(pdf_table.c.pdf_file_id.in_(candidates.scalar_subquery()))
+            .values(
+                status='Processing',
+                processing_attempts=pdf_table.c.processing_attempts + 1,
+                last_changed_at=func.now(),
+            )
+            .returning(
+                pdf_table.c.pdf_file_id, pdf_table.c.pdf_file_name, pdf_table.c.pdf_file_path,
+                pdf_table.c.total_pages, pdf_table.c.pdf_file_size, pdf_table.c.created_at,
+                cost.label('schedule_cost'),
+            )
+        )
+        session = self.get_new_session()
+        try:
+            failed = session.execute(fail_exhausted).scalars().all()
+            claimed = session.execute(stmt).all()
+            session.commit()
+        finally:
+            session.close()
+
+        if failed:
+            self.logger.error(
+                f"Marked {len(failed)} PDFs failed after {max_attempts} attempts whose lease expired: {failed[:10]}")
+        # RETURNING has no order; now() is fixed within the transaction, so the
+        # returned cost is the one the candidates were ordered by
+        claimed.sort(key=lambda row: (row.schedule_cost, row.created_at))
+        if claimed:
+            self.logger.info(f"Claimed {len(claimed)} pending PDFs.")
+        return claimed
+
+    def release_pdf_claims(self, pdf_file_ids, max_attempts=3, refund_attempt=False):
+        """
+        Hands claimed PDFs back after a failure or shutdown.
+
+        A failed row goes back to 'Pending' (retried after retry_seconds) until it
+        has been claimed max_attempts times, then it is marked 'failed'. With
+        refund_attempt (claimed but never started) it goes back to 'Pending' and
+        the attempt is not counted.
+        """
+        pdf_file_ids = list(pdf_file_ids)
+        if not pdf_file_ids:
+            return
+        pdf_table = PDFFile.__table__
+        if refund_attempt:
+            values = {
+                'status': 'Pending',
+                'processing_attempts': pdf_table.c.processing_attempts - 1,
+            }
+        else:
+            values = {
+                'status': case(
+                    (pdf_table.c.processing_attempts >= max_attempts, 'failed'),
+                    else_='Pending'),
+            }
+        values['last_changed_at'] = func.now()
+        stmt = (
+            update(pdf_table)
+            .where(pdf_table.c.pdf_file_id.in_(pdf_file_ids))
+            .where(pdf_table.c.status == 'Processing')
+            .values(**values)
+        )
         session = self.get_new_session()
+        try:
+            session.execute(stmt)
+            session.commit()
+        finally:
+            session.close()
+        self.logger.info(f"Released {len(pdf_file_ids)} PDF claims (refund_attempt={refund_attempt}).")
 
-        query = session.query(PDFFile)
-        all_pdfs = query.all()
+    def has_image_records(self, pdf_uuid):
+        """True if the PDF already has page rows, e.g. from an earlier attempt that failed midway."""
+        session = self.get_new_session()
+        try:
+            return session.query(ImageFile.image_file_id).filter_by(pdf_file_id=pdf_uuid).first() is not None
+        finally:
+            session.close()
+
+    def get_pdfs_for_backfill(self, pdf_file_names=None, status='done', limit=None):
+        """
+        Selects PDFs to rerun stages on, in one query.
+
+        Args:
+            pdf_file_names (list of str, optional): Restrict to these files, otherwise every PDF with status.
+            status (str, optional): Only PDFs in this status; None for any.
+            limit (int, optional): Maximum number of PDFs.
+
+        Returns:
+            list of rows with pdf_file_id, pdf_file_name, pdf_public_url and total_pages.
+        """
+        session = self.get_read_session()
+        try:
+            query = session.query(
+                PDFFile.pdf_file_id, PDFFile.pdf_file_name, PDFFile.pdf_public_url, PDFFile.total_pages)
+            if status is not None:
+                query = query.filter(PDFFile.status == status)
+            if pdf_file_names is not None:
+                query = query.filter(PDFFile.pdf_file_name.in_(list(pdf_file_names)))
+            query = query.order_by(PDFFile.created_at)
+            if limit is not None:
+                query = query.limit(limit)
+            return query.all()
+        finally:
+            session.close()
+
+    def get_all_pdf_filenames(self):
+        session = self.get_read_session()
+
+        query = session.query(PDFFile.pdf_file_name)
+        all_pdf_file_name_list = [row.pdf_file_name for row in query]
 
         session.close()
-        all_pdf_file_name_list = [pdf.pdf_file_name for pdf in all_pdfs]
         return all_pdf_file_name_list
 
-    def check_process_status(self, pdf_file_name=None, pdf_file_path=None):
+    def get_existing_pdf_filenames(self, pdf_file_names, chunk_size=1000):
+        """Returns the subset of the given names that already have a datasheet_files row."""
+        pdf_file_names = list(set(pdf_file_names))
+        existing = set()
+        if not pdf_file_names:
+            return existing
+
+        session = self.get_read_session()
+        try:
+            for i in range(0, len(pdf_file_names), chunk_size):
+                chunk = pdf_file_names[i:i + chunk_size]
+                query = session.query(PDFFile.pdf_file_name).filter(
+                    PDFFile.pdf_file_name.in_(chunk))
+                existing.update(row.pdf_file_name for row in query)
+        finally:
+            session.close()
+        return existing
+
+    def get_pdf_statuses(self, pdf_file_names, chunk_size=1000):
+        """Returns {pdf_file_name: status} for the given names that exist, in one query per chunk."""
+        pdf_file_names = list(set(pdf_file_names))
+        statuses = {}
+        if not pdf_file_names:
+            return statuses
+
+        session = self.get_read_session()
+        try:
+            for i in range(0, len(pdf_file_names), chunk_size):
+                chunk = pdf_file_names[i:i + chunk_size]
+                query = session.query(PDFFile.pdf_file_name, PDFFile.status).filter(
+                    PDFFile.pdf_file_name.in_(chunk))
+                statuses.update((row.pdf_file_name, row.status) for row in query)
+        finally:
+            session.close()
+        return statuses
+
+    def get_drive_page_token(self, drive_folder_id):
         session = self.get_new_session()
+        try:
+            state = session.get(DriveSyncState, drive_folder_id)
+            return state.page_token if state else None
+        finally:
+            session.close()
+
+    def get_drive_retry_files(self, drive_folder_id, max_attempts):
+        """Returns [(file_name, drive_file_id)] of earlier failed Drive files with retries left."""
+        session = self.get_new_session()
+        try:
+            rows = (
+                session.query(DriveSyncRetry.file_name, DriveSyncRetry.drive_file_id)
+                .filter(DriveSyncRetry.drive_folder_id == drive_folder_id)
+                .filter(DriveSyncRetry.attempts < max_attempts)
+                .all()
+            )
+            return [(row.file_name, row.drive_file_id) for row in rows]
+        finally:
+            session.close()
+
+    def save_drive_sync(self, drive_folder_id, page_token, failed_files, ingested_file_ids):
+        """
+        Advances the Drive page token and updates the retry list in one transaction.
+
+        Args:
+            drive_folder_id (str): The synced folder.
+            page_token (str): Change log position to resume from next time.
+            failed_files (list of tuple): (file_name, drive_file_id) that got no
+                datasheet_files row; their attempt count goes up by one.
+            ingested_file_ids (list of str): Drive file ids that are ingested now,
+                dropped from the retry list.
+        """
+        retry_table = DriveSyncRetry.__table__
+        session = self.get_new_session()
+        try:
+            state = session.get(DriveSyncState, drive_folder_id)
+            if state:
+                state.page_token = page_token
+            else:
+                session.add(DriveSyncState(
+                    drive_folder_id=drive_folder_id, page_token=page_token))
+            if ingested_file_ids:
+                session.execute(
+                    retry_table.delete()
+                    .where(retry_table.c.drive_folder_id == drive_folder_id)
+                    .where(retry_table.c.drive_file_id.in_(list(ingested_file_ids))))
+            if failed_files:
+                stmt = pg_insert(retry_table).values([
+                    {
+                        'drive_folder_id': drive_folder_id,
+                        'drive_file_id': file_id,
+                        'file_name': file_name,
+                        'attempts': 1,
+                    }
+                    for file_name, file_id in failed_files
+                ])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[retry_table.c.drive_folder_id, retry_table.c.drive_file_id],
+                    set_={
+                        'file_name': stmt.excluded.file_name,
+                        'attempts': retry_table.c.attempts + 1,
+                        'last_changed_at': func.now(),
+                    })
+                session.execute(stmt)
+            session.commit()
+            self.logger.info(
+                f"Saved Drive page token for folder {drive_folder_id} "
+                f"({len(failed_files)} files left to retry).")
+        finally:
+            session.close()
+
+    def check_process_status(self, pdf_file_name=None, pdf_file_path=None):
+        session = self.get_read_session()
 
         # Build query based on the provided parameter
-        query = session.query(PDFFile).filter(PDFFile.status == 'done')
+        query = session.query(PDFFile.pdf_file_id).filter(PDFFile.status == 'done')
 
         if pdf_file_name:
             pdf_record = query.filter_by(pdf_file_name=pdf_file_name).first()
@@ -242,7 +1074,7 @@ class DBManager:
 
     def get_pdf_uuid(self, pdf_file_name=None, pdf_file_path=None):
         session = self.get_new_session()
-        query = session.query(PDFFile)
+        query = session.query(PDFFile.pdf_file_id)
 
         if pdf_file_name:
             pdf_record = query.filter_by(pdf_file_name=pdf_file_name).first()
@@ -269,9 +1101,9 @@ class DBManager:
         return pdf_uuid
 
     def get_pdf_status(self, pdf_file_name=None):
-        session = self.get_new_session()
+        session = self.get_read_session()
         try:
-            query = session.query(PDFFile)
+            query = session.query(PDFFile.status)
 
             if pdf_file_name:
                 pdf_record = query.filter_by(pdf_file_name=pdf_file_name).first()
@@ -343,3 +1175,83 @@ class DBManager:
                 f"No image file found for '{image_file_name}' with PDF UUID '{pdf_uuid}'.")
 
         return image_uuid
+
+    def search_pages(self, search_query, limit=20, offset=0):
+        """
+        Full-text search over extracted page text.
+
+        Args:
+            search_query (str): Web-search style query, e.g. '"LM317" -obsolete'.
+            limit (int): Maximum number of pages to return.
+            offset (int): Number of ranked pages to skip, for pagination.
+
+        Returns:
+            list of dict: Matching pages ordered by rank, best first.
+        """
+        session = self.get_read_session()
+        try:
+            ts_query = func.websearch_to_tsquery(TEXT_SEARCH_CONFIG, search_query)
+            rank = func.ts_rank_cd(ImageFile.search_vector, ts_query).label('rank')
+            rows = (
+                session.query(
+                    ImageFile.image_file_id,
+                    ImageFile.image_file_order,
+                    ImageFile.image_public_uri,
+                    PDFFile.pdf_file_id,
+                    PDFFile.pdf_file_name,
+                    PDFFile.pdf_public_url,
+                    rank,
+                )
+                .join(PDFFile, PDFFile.pdf_file_id == ImageFile.pdf_file_id)
+                .filter(ImageFile.search_vector.op('@@')(ts_query))
+                .order_by(desc(rank), ImageFile.pdf_file_id, ImageFile.image_file_order)
+                .limit(limit)
+                .offset(offset)
+                .all()
+            )
+            self.logger.info(
+                f"Page search for '{search_query}' returned {len(rows)} rows (offset {offset}).")
+            return [dict(row._mapping) for row in rows]
+        finally:
+            session.close()
+
+    def search_pdfs(self, search_query, limit=20, offset=0):
+        """
+        Full-text search grouped by PDF, ranked by the best matching page.
+
+        Args:
+            search_query (str): Web-search style query.
+            limit (int): Maximum number of PDFs to return.
+            offset (int): Number of ranked PDFs to skip, for pagination.
+
+        Returns:
+            list of dict: One entry per PDF with its best rank and the matching page orders.
+        """
+        session = self.get_read_session()
+        try:
+            ts_query = func.websearch_to_tsquery(TEXT_SEARCH_CONFIG, search_query)
+            best_rank = func.max(func.ts_rank_cd(ImageFile.search_vector, ts_query)).label('rank')
+            matching_pages = func.array_agg(
+                aggregate_order_by(ImageFile.image_file_order, ImageFile.image_file_order)
+            ).label('matching_pages')
+            rows = (
+                session.query(
+                    PDFFile.pdf_file_id,
+                    PDFFile.pdf_file_name,
+                    PDFFile.pdf_public_url,
+                    best_rank,
+                    matching_pages,
+                )
+                .join(ImageFile, PDFFile.pdf_file_id == ImageFile.pdf_file_id)
+                .filter(ImageFile.search_vector.op('@@')(ts_query))
+                .group_by(PDFFile.pdf_file_id, PDFFile.pdf_file_name, PDFFile.pdf_public_url)
+                .order_by(desc(best_rank), PDFFile.pdf_file_name)
+                .limit(limit)
+                .offset(offset)
+                .all()
+            )
+            self.logger.info(
+                f"PDF search for '{search_query}' returned {len(rows)} rows (offset {offset}).")
+            return [dict(row._mapping) for row in rows]
+        finally:
+            session.close()
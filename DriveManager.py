@@ -7,12 +7,18 @@ import time
 
 
 class DriveManager:
-    def __init__(self, credentials_json_path, drive_folder_id, tmp_folder_path):
+    def __init__(self, credentials_json_path, drive_folder_id, tmp_folder_path, drive_service=None, max_file_retries=5):
         self.tmp_folder_path = tmp_folder_path
         self.drive_folder_id = drive_folder_id
         self.service_account_file = credentials_json_path
-        self.drive_service = self._init_drive_service()
+        # A prebuilt service (e.g. pointed at a local fake endpoint) skips credential loading
+        self.drive_service = drive_service or self._init_drive_service()
         self.logger = LoggerManager().get_logger(self.__class__.__name__)
+        # A file that never gets ingested is retried by this many later syncs, then left alone
+        self.max_file_retries = max_file_retries
+        # Token and (file id, file name) candidates of the last check, see commit_sync
+        self.pending_page_token = None
+        self.pending_files = []
 
     def _init_drive_service(self):
         # Initialize Google Drive service
@@ -48,61 +54,144 @@ class DriveManager:
 
         return all_files
 
+    def get_start_page_token(self):
+        # Token marking "now" in the Drive change log
+        response = self.drive_service.changes().getStartPageToken().execute()
+        return response['startPageToken']
+
+    def list_changed_files(self, page_token):
+        """
+        Lists files added or modified in the watched folder since page_token.
+
+        Returns:
+            tuple: ([(name, id), ...], new_start_page_token)
+        """
+        changed_files = {}
+        new_start_page_token = None
+
+        while page_token:
+            results = self.drive_service.changes().list(
+                pageToken=page_token,
+                spaces="drive",
+                includeRemoved=False,
+                fields="nextPageToken, newStartPageToken, "
+                       "changes(fileId, removed, file(id, name, parents, trashed))"
+            ).execute()
+
+            for change in results.get('changes', []):
+                file = change.get('file')
+                if change.get('removed') or not file or file.get('trashed'):
+                    continue
+                if self.drive_folder_id not in file.get('parents', []):
+                    continue
+                # A file may appear several times in the log; keep the latest name
+                changed_files[file['id']] = file['name']
+
+            new_start_page_token = results.get('newStartPageToken', new_start_page_token)
+            page_token = results.get('nextPageToken')
+
+        return [(name, file_id) for file_id, name in changed_files.items()], new_start_page_token
+
     def get_file_url(self, file_id):
         # Construct URL for accessing Google Drive file
         return f"https://drive.google.com/uc?id={file_id}"
 
+    @staticmethod
+    def normalize_filename(filename):
+        # Remove query parameters if any and ensure .pdf extension
+        filename = filename.split('?')[0]
+        filename = filename.split(".pdf")[0] + ".pdf"
+        if '.pdf' not in filename:
+            filename += ".pdf"
+        return filename
+
     def check_and_download_new_files(self, db_manager):
-        # Get all files in the Google Drive folder
-        drive_files = self.list_files()
-        drive_filenames = {filename for filename, _ in drive_files}
-        original_to_modified = {}
-        for filename, file_id in drive_files:
-            modified_filename = filename.split('?')[0]  # Remove query parameters if any
-            modified_filename = modified_filename.split(".pdf")[0] + ".pdf"  # Ensure .pdf extension
-            if '.pdf' not in modified_filename:
-                modified_filename += ".pdf"
-            
-            # Map original filename to modified filename
-            original_to_modified[filename] = modified_filename
-
-        modified_drive_filenames = set(original_to_modified.values())
-        # Get all filenames in the database
-        # Assuming db_manager has a method to retrieve all filenames
-        db_filenames = set(db_manager.get_all_pdf_filenames())
-
-        # Find new files by difference
-        # new_files = drive_filenames - db_filenames
-        # new_files = [(filename, file_id) for filename,
-                    #  file_id in drive_files if filename in new_filenames]
-        new_modified_filenames = modified_drive_filenames - db_filenames
+        # Only changes since the last successful sync are fetched; the first run
+        # falls back to a full listing and records where the change log stands.
+        page_token = db_manager.get_drive_page_token(self.drive_folder_id)
+        if page_token:
+            drive_files, new_page_token = self.list_changed_files(page_token)
+            self.logger.info(f"number of changed files since last sync: {len(drive_files)}")
+        else:
+            # Take the token before listing so nothing added meanwhile is missed
+            new_page_token = self.get_start_page_token()
+            drive_files = self.list_files()
+            self.logger.info(f"No Drive sync token found, listed {len(drive_files)} files.")
+
+        # Files earlier syncs could not ingest are not in the change log any more
+        listed_ids = {file_id for _, file_id in drive_files}
+        retry_files = [
+            (filename, file_id)
+            for filename, file_id in db_manager.get_drive_retry_files(self.drive_folder_id, self.max_file_retries)
+            if file_id not in listed_ids
+        ]
+        if retry_files:
+            self.logger.info(f"Retrying {len(retry_files)} Drive files that failed to ingest before.")
+        drive_files = drive_files + retry_files
+
+        modified_names = {
+            file_id: self.normalize_filename(filename) for filename, file_id in drive_files
+        }
+        existing_filenames = db_manager.get_existing_pdf_filenames(modified_names.values())
+
         new_files = [
-                (original_filename, file_id)
-                for original_filename, (modified_filename, file_id) in zip(
-                    original_to_modified.keys(), drive_files
-                )
-                if modified_filename in new_modified_filenames
-            ]
+            (filename, file_id)
+            for filename, file_id in drive_files
+            if modified_names[file_id] not in existing_filenames
+        ]
         self.logger.info(f"number of new files found :{len(new_files)}")
 
         downloaded_files = []
         for filename, file_id in new_files:
             file_url = self.get_file_url(file_id)
-            filename,file_path = self.download_file(file_id, filename)
+            try:
+                filename,file_path = self.download_file(file_id, filename)
+            except Exception as e:
+                # Left without a row, so commit_sync records it for a retry
+                self.logger.error(f"Could not download {filename} from Google Drive: {e}")
+                continue
             downloaded_files.append((filename, file_path, file_url))
             self.logger.info(
                 f"Downloaded new file {filename} from Google Drive.")
 
+        # The token is only saved by commit_sync, after the files are ingested.
+        # Retried files that exist by now are kept so commit_sync clears them.
+        self.pending_page_token = new_page_token
+        self.pending_files = [(file_id, modified_names[file_id]) for _, file_id in new_files]
+        retried_existing = [
+            (file_id, modified_names[file_id]) for _, file_id in retry_files
+            if modified_names[file_id] in existing_filenames
+        ]
+        self.pending_files.extend(retried_existing)
+
         return downloaded_files
 
+    def commit_sync(self, db_manager):
+        """
+        Saves the page token of the last check after ingest, so the next run only
+        reads changes made since. Files from that check that still have no
+        datasheet_files row are recorded with an attempt count and retried by
+        the next max_file_retries syncs instead of holding the token back.
+        """
+        if not self.pending_page_token:
+            return False
+
+        existing = db_manager.get_existing_pdf_filenames(name for _, name in self.pending_files)
+        failed = [(name, file_id) for file_id, name in self.pending_files if name not in existing]
+        ingested_ids = [file_id for file_id, name in self.pending_files if name in existing]
+        if failed:
+            self.logger.warning(
+                f"{len(failed)} Drive files were not ingested, they are retried by later syncs: "
+                f"{[name for name, _ in failed[:10]]}")
+
+        db_manager.save_drive_sync(self.drive_folder_id, self.pending_page_token, failed, ingested_ids)
+        self.pending_page_token = None
+        self.pending_files = []
+        return True
+
     def download_file(self, file_id, filename):
         # Clean up filename and create temporary path
-        if '?' in filename:
-            filename = filename.split('?')[0]
-        filename=filename.split(".pdf")[0]+".pdf"
-        
-        if '.pdf' not in filename:
-            filename=filename+".pdf"
+        filename = self.normalize_filename(filename)
         tmp_path = os.path.join(self.tmp_folder_path, filename)
 
         # Handle possible '?' in tmp_path
@@ -50,3 +50,19 @@ class GCSManager:
             return f"https://storage.googleapis.com/{self.pdf_bucket.name}/{destination_blob_name}"
 
         return self._retry_upload(upload)
+
+    def pdf_blob_name_from_url(self, public_url):
+        # Inverse of the URL built in upload_pdf
+        prefix = f"https://storage.googleapis.com/{self.pdf_bucket.name}/"
+        if not public_url or not public_url.startswith(prefix):
+            raise ValueError(f"URL is not in bucket {self.pdf_bucket.name}: {public_url}")
+        return public_url[len(prefix):]
+
+    def download_pdf(self, blob_name, destination_path):
+        def download():
+            blob = self.pdf_bucket.blob(blob_name)
+            blob.download_to_filename(destination_path)
+            self.logger.info(f"Downloaded PDF {blob_name} from bucket {self.pdf_bucket.name}")
+            return destination_path
+
+        return self._retry_upload(download)
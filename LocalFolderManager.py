@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import tempfile
+from Logger import LoggerManager
+
+
+class LocalFolderManager:
+    """
+    Local folder source that remembers which PDFs it has already handed to the
+    pipeline, so a run only looks at files that are new on disk.
+
+    The manifest maps file name -> {path, size, mtime} and is kept outside the
+    input folder (which may be read-only or network-mounted). A file whose
+    name was already ingested but whose size or mtime changed is logged, not
+    re-ingested, since datasheet_files rows are keyed on the file name.
+    """
+
+    def __init__(self, folder_path, manifest_path=None, state_dir=None):
+        self.folder_path = folder_path
+        self.manifest_path = manifest_path or self.default_manifest_path(folder_path, state_dir)
+        self.logger = LoggerManager().get_logger(self.__class__.__name__)
+        self.manifest = self._load_manifest()
+        self.pending_entries = []
+
+    @staticmethod
+    def default_manifest_path(folder_path, state_dir=None):
+        # One manifest per input folder, under state_dir (temp_path) or the system temp dir
+        folder_key = hashlib.sha1(os.path.abspath(folder_path).encode()).hexdigest()[:12]
+        return os.path.join(state_dir or tempfile.gettempdir(), f".pdf_manifest_{folder_key}.json")
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Could not read manifest {self.manifest_path}, starting empty: {e}")
+            return {}
+
+    def save_manifest(self):
+        # Write to a temp file first so a crash never leaves a truncated manifest.
+        # The manifest only saves work, so failing to write it must not fail the run.
+        tmp_path = f"{self.manifest_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as file:
+                json.dump(self.manifest, file)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            self.logger.error(f"Could not write manifest {self.manifest_path}: {e}")
+
+    def scan(self):
+        """
+        Returns the PDFs in the folder that are not in the manifest yet.
+
+        Returns:
+            list of dict: Entries with 'name', 'path', 'size' and 'mtime'.
+        """
+        new_entries = []
+        changed = 0
+
+        with os.scandir(self.folder_path) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(".pdf"):
+                    continue
+                stat = entry.stat()
+                known = self.manifest.get(entry.name)
+                if known and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+                    continue
+
+                record = {
+                    'name': entry.name,
+                    'path': entry.path,
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                }
+                if known:
+                    self.logger.warning(
+                        f"PDF {entry.name} changed on disk after it was ingested; it is not re-ingested.")
+                    self.manifest[entry.name] = {k: v for k, v in record.items() if k != 'name'}
+                    changed += 1
+                    continue
+                new_entries.append(record)
+
+        if changed:
+            self.save_manifest()
+        self.logger.info(
+            f"Found {len(new_entries)} new PDFs in {self.folder_path} "
+            f"({len(self.manifest)} already in manifest, {changed} changed).")
+        return new_entries
+
+    def mark_seen(self, entries):
+        for record in entries:
+            self.manifest[record['name']] = {k: v for k, v in record.items() if k != 'name'}
+        self.save_manifest()
+
+    def check_new_files(self):
+        """Returns new files as (filename, file_path, file_url) tuples like DriveManager."""
+        self.pending_entries = self.scan()
+        return [(record['name'], record['path'], "") for record in self.pending_entries]
+
+    def commit_seen(self, db_manager):
+        """Records pending entries that made it into the DB, failures are retried next run."""
+        if not self.pending_entries:
+            return
+        existing = db_manager.get_existing_pdf_filenames(
+            record['name'] for record in self.pending_entries)
+        self.mark_seen([record for record in self.pending_entries if record['name'] in existing])
+        self.pending_entries = []
@@ -0,0 +1,86 @@
+import io
+import mmap
+import os
+from image_text_extractor import count_pdf_pages
+
+
+class PDFBufferReader(io.RawIOBase):
+    """Independent seekable reader over a shared PDFBuffer, so threads don't share a file position."""
+
+    def __init__(self, view):
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if self._pos < 0:
+            raise ValueError("Negative seek position")
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+class PDFBuffer:
+    """
+    A PDF opened once and memory-mapped read-only.
+
+    Every stage (GCS upload, page counting, text extraction) reads through its
+    own reader() over the same mapping instead of reopening the file. Rendering
+    still goes through pdf_path since poppler reads the file itself, but it
+    then hits the page cache populated here. Nothing hashes whole PDFs: the
+    local folder scan tracks files by size and mtime without reading them, so
+    this mapping is the only read of a new local PDF before rendering.
+    """
+
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        self._file = open(pdf_path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        # mmap refuses empty files
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self.view = memoryview(self._mmap) if self._mmap is not None else memoryview(b"")
+        self._page_count = None
+        self._page_count_known = False
+
+    def reader(self):
+        return PDFBufferReader(self.view)
+
+    @property
+    def page_count(self):
+        if not self._page_count_known:
+            self._page_count = count_pdf_pages(self.reader())
+            self._page_count_known = True
+        return self._page_count
+
+    def close(self):
+        self.view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,82 +1,132 @@
 import os
+import hashlib
 from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from slugify import slugify
 from pathlib import Path
 from Logger import LoggerManager
-from image_text_extractor import save_pdf_page_as_image,extract_text_by_page
+from PDFBuffer import PDFBuffer
+from image_text_extractor import save_pdf_page_as_image,iter_text_by_page
 
 class PDFProcessor:
-    def __init__(self, db_manager, gcs_manager):
+    def __init__(self, db_manager, gcs_manager, image_executor=None, text_executor=None):
         self.logger = LoggerManager().get_logger(self.__class__.__name__)
         self.db_manager = db_manager
         self.gcs_manager = gcs_manager
+        # Long-running workers pass shared pools; one-shot runs get a pool per call
+        self.image_executor = image_executor
+        self.text_executor = text_executor
+
+    def _run_all(self, shared_executor, max_workers, fn, items, *args):
+        if shared_executor is not None:
+            futures = [shared_executor.submit(fn, item, *args) for item in items]
+            for future in futures:
+                future.result()
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fn, item, *args) for item in items]
+
+            # Wait for all futures to complete
+            for future in futures:
+                future.result()
+
+    def process_and_upload_pdf(self, pdf_path, dpi=200, batch_size=100, pdf_buffer=None):
+        # Read the file once and share the mapping with every stage
+        if pdf_buffer is None:
+            with PDFBuffer(pdf_path) as owned_buffer:
+                return self.process_and_upload_pdf(pdf_path, dpi=dpi, batch_size=batch_size, pdf_buffer=owned_buffer)
 
-    def process_and_upload_pdf(self, pdf_path, dpi=200, batch_size=100):
         # Insert PDF record in the database
         pdf_file_name = os.path.basename(pdf_path)
         pdf_uuid = self.db_manager.get_pdf_uuid(pdf_file_name=pdf_file_name)
         upload_pdf_file_name = slugify(pdf_file_name)[:50]
 
         if not pdf_uuid:
-            with open(pdf_path, "rb") as pdf_file_data:
-                public_uri = self.gcs_manager.upload_pdf(pdf_file_data, upload_pdf_file_name)
+            public_uri = self.gcs_manager.upload_pdf(pdf_buffer.reader(), upload_pdf_file_name)
 
-            self.db_manager.insert_pdf_files(pdf_file_name,pdf_path,public_uri)
+            self.db_manager.insert_pdf_files(pdf_file_name,pdf_path,public_uri,pdf_buffer=pdf_buffer)
 
             pdf_uuid = self.db_manager.get_pdf_uuid(pdf_file_name=pdf_file_name)
 
+        # A retry after a failure midway repoints the page rows it already wrote instead of duplicating them
+        replace_existing = self.db_manager.has_image_records(pdf_uuid)
+
         # Process each page: convert to image, upload, extract text, and insert to DB
         # Use ThreadPoolExecutor to upload images in batches
        
-        for image_batch in save_pdf_page_as_image(pdf_path, dpi=dpi, batch_size=batch_size):
+        for image_batch in save_pdf_page_as_image(pdf_path, dpi=dpi, batch_size=batch_size, page_count=pdf_buffer.page_count):
             self.logger.info(f"Length of image list received: {len(image_batch)}")
-            self.process_image_batch(image_batch, upload_pdf_file_name,pdf_uuid)
+            self.process_image_batch(image_batch, upload_pdf_file_name,pdf_uuid, replace_existing)
 
 
-        text_pages = extract_text_by_page(Path(pdf_path))
-        with ThreadPoolExecutor(max_workers=20) as executor:
-            futures = []
-            for text_entry in text_pages:
-                futures.append(executor.submit(self.update_image_text, text_entry, upload_pdf_file_name,pdf_uuid))
-
-            # Wait for all futures to complete
-            for future in futures:
-                future.result()
+        self.stream_page_texts(pdf_path, pdf_uuid, pdf_buffer=pdf_buffer)
 
         # Update PDF status after all processing
         self.db_manager.update_pdf_status(pdf_uuid)
 
 
-    def update_image_text(self,text_entry,upload_pdf_file_name,pdf_uuid):
-        image_index = text_entry['file_id'][0]
-        image_uuid = self.db_manager.get_image_uuid(f"{upload_pdf_file_name}_{image_index}.png",pdf_uuid)
-        self.db_manager.update_extracted_text(image_uuid, text_entry['payload'])
-
-
-
-    def upload_image(self, image_data, upload_pdf_file_name, pdf_uuid):
+    def stream_page_texts(self, pdf_path, pdf_uuid, flush_size=5, flush_chars=64 * 1024, pdf_buffer=None):
+        """
+        Parses page text and writes it to the DB in batches while parsing continues.
+        A batch is flushed every flush_size pages or flush_chars characters, whichever
+        comes first; small enough that PDFs under max_allowed_page still get several
+        writes overlapped with parsing. At most one batch write is outstanding.
+        """
+        executor = self.text_executor or ThreadPoolExecutor(max_workers=1)
+        pending_write = None
+        batch = []
+        batch_chars = 0
+        try:
+            for page in iter_text_by_page(Path(pdf_path), pdf_buffer=pdf_buffer):
+                batch.append(page)
+                batch_chars += len(page.text)
+                if len(batch) >= flush_size or batch_chars >= flush_chars:
+                    if pending_write is not None:
+                        pending_write.result()
+                    pending_write = executor.submit(self.db_manager.update_extracted_texts, pdf_uuid, batch)
+                    batch = []
+                    batch_chars = 0
+
+            if pending_write is not None:
+                pending_write.result()
+            self.db_manager.update_extracted_texts(pdf_uuid, batch)
+        finally:
+            if executor is not self.text_executor:
+                executor.shutdown(wait=True)
+
+
+
+    @staticmethod
+    def page_content_hash(image):
+        # Hash the rendered pixels so duplicates are caught before PNG encoding
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def upload_image(self, image_data, upload_pdf_file_name, pdf_uuid, replace_existing=False):
         image_index = image_data['file_id'][0]
         image = image_data['payload']
-
-        image_file_name = f"{upload_pdf_file_name}/{image_index}.png"
-        image_bytes = BytesIO()
-        image.save(image_bytes, format="PNG")
-        image_bytes.seek(0)  # Reset buffer position to the beginning
-
-        # Upload the image file to GCS directly from the bytes buffer
-        public_uri = self.gcs_manager.upload_image(image_bytes, image_file_name)
-
-        # Insert into DB
-        self.db_manager.insert_image_record(pdf_uuid, f"{upload_pdf_file_name}_{image_index}.png", image_index, public_uri)
-
-    def process_image_batch(self, image_batch, upload_pdf_file_name, pdf_uuid):
-        with ThreadPoolExecutor(max_workers=9) as executor:
-            # Submit all the image uploads to the thread pool
-            futures = []
-            for image_data in image_batch:
-                futures.append(executor.submit(self.upload_image, image_data, upload_pdf_file_name, pdf_uuid))
-
-            # Wait for all futures to complete
-            for future in futures:
-                future.result()
+        content_hash = self.page_content_hash(image)
+
+        # Identical pages (covers, legal boilerplate, ...) reuse the object uploaded first
+        public_uri = self.db_manager.get_page_image_uri(content_hash)
+        if public_uri:
+            self.logger.info(f"Reusing existing image for {upload_pdf_file_name} page {image_index}")
+        else:
+            image_file_name = f"pages/{content_hash[:2]}/{content_hash}.png"
+            image_bytes = BytesIO()
+            image.save(image_bytes, format="PNG")
+            image_bytes.seek(0)  # Reset buffer position to the beginning
+
+            # Upload the image file to GCS directly from the bytes buffer
+            public_uri = self.gcs_manager.upload_image(image_bytes, image_file_name)
+
+        # Insert into DB, or repoint the existing page row when backfilling
+        record_image = self.db_manager.replace_image_record if replace_existing else self.db_manager.insert_image_record
+        record_image(pdf_uuid, f"{upload_pdf_file_name}_{image_index}.png", image_index, public_uri, content_hash=content_hash)
+
+    def process_image_batch(self, image_batch, upload_pdf_file_name, pdf_uuid, replace_existing=False):
+        # Submit all the image uploads to the thread pool
+        self._run_all(self.image_executor, 9, self.upload_image, image_batch, upload_pdf_file_name, pdf_uuid, replace_existing)
@@ -0,0 +1,173 @@
+import select
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Logger import LoggerManager
+from PDFProcessor import PDFProcessor
+from utils import get_local_pdf_path
+
+
+class PipelineWorker:
+    """
+    Long-running processor for Pending PDFs.
+
+    Keeps the DB engine, GCS client and thread pools warm between PDFs and
+    wakes as soon as Postgres NOTIFYs that a datasheet_files row became
+    Pending. Rows are claimed atomically (DBManager.claim_pending_pdfs), so
+    several workers and one-shot runs can share the queue. A periodic poll
+    covers missed notifications and picks up failed PDFs once their retry
+    delay passes; after max_attempts they are marked failed. SIGTERM/SIGINT
+    stop intake, let in-flight PDFs finish and hand queued claims back to Pending.
+    """
+
+    def __init__(self, db_manager, gcs_manager, temp_path, max_workers=4, dpi=100, batch_size=100,
+                 poll_interval=60, retry_interval=600, max_attempts=3):
+        self.logger = LoggerManager().get_logger(self.__class__.__name__)
+        self.db_manager = db_manager
+        self.temp_path = temp_path
+        self.dpi = dpi
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+
+        self.max_workers = max_workers
+        self.pdf_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf")
+        self.image_executor = ThreadPoolExecutor(max_workers=9, thread_name_prefix="image")
+        # One outstanding text batch write per PDF, see PDFProcessor.stream_page_texts
+        self.text_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="text")
+        self.pdf_processor = PDFProcessor(
+            db_manager, gcs_manager,
+            image_executor=self.image_executor, text_executor=self.text_executor)
+
+        self._stop = threading.Event()
+        self._slot_free = threading.Event()
+        self._lock = threading.Lock()
+        # Claimed pdf_file_ids whose job has not finished (queued or running)
+        self._in_flight = set()
+        self._listen_conn = None
+
+    def request_stop(self, signum=None, frame=None):
+        if not self._stop.is_set():
+            self.logger.info(f"Received signal {signum}, draining in-flight PDFs.")
+        self._stop.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+    def _process_pdf(self, pdf):
+        pdf_file_path = get_local_pdf_path(pdf, self.temp_path)
+        try:
+            self.logger.info(f"Started processing for PDF: {pdf.pdf_file_name}")
+            self.pdf_processor.process_and_upload_pdf(
+                pdf_path=pdf_file_path, dpi=self.dpi, batch_size=self.batch_size)
+            self.logger.info(f"Processing completed for PDF: {pdf.pdf_file_name}")
+        except Exception as e:
+            self.logger.error(f"An error occurred while processing {pdf_file_path}: {e}")
+            try:
+                self.db_manager.release_pdf_claims([pdf.pdf_file_id], max_attempts=self.max_attempts)
+            except Exception as release_e:
+                # The claim lease expires and the row is retried later anyway
+                self.logger.error(f"Could not release claim on {pdf.pdf_file_name}: {release_e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(pdf.pdf_file_id)
+            self._slot_free.set()
+
+    def submit_pending(self):
+        """
+        Claims the next Pending PDFs from the scheduler for the free worker
+        slots only, so a short PDF arriving later can still overtake queued
+        large ones.
+        """
+        with self._lock:
+            free_slots = self.max_workers - len(self._in_flight)
+        if free_slots <= 0:
+            return
+
+        claimed = self.db_manager.claim_pending_pdfs(
+            limit=free_slots, retry_seconds=self.retry_interval, max_attempts=self.max_attempts)
+        for pdf in claimed:
+            with self._lock:
+                self._in_flight.add(pdf.pdf_file_id)
+            self.pdf_executor.submit(self._process_pdf, pdf)
+        if claimed:
+            self.logger.info(f"Submitted {len(claimed)} pending PDFs.")
+
+    def _connect_listener(self):
+        try:
+            self._listen_conn = self.db_manager.listen_connection()
+        except Exception as e:
+            self.logger.error(f"Could not LISTEN for pending PDFs, falling back to polling: {e}")
+            self._listen_conn = None
+
+    def _close_listener(self):
+        if self._listen_conn is not None:
+            try:
+                self._listen_conn.close()
+            except Exception:
+                pass
+            self._listen_conn = None
+
+    def wait_for_work(self):
+        """Blocks until a NOTIFY arrives, a slot frees up, the poll interval passes or a stop is requested."""
+        deadline = time.monotonic() + self.poll_interval
+        while not self._stop.is_set():
+            if self._slot_free.is_set():
+                self._slot_free.clear()
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            # Short slices keep SIGTERM and freed slots responsive
+            timeout = min(remaining, 1.0)
+
+            if self._listen_conn is None:
+                self._slot_free.wait(timeout)
+                continue
+
+            try:
+                readable, _, _ = select.select([self._listen_conn], [], [], timeout)
+                if not readable:
+                    continue
+                self._listen_conn.poll()
+                if self._listen_conn.notifies:
+                    self._listen_conn.notifies.clear()
+                    return
+            except Exception as e:
+                self.logger.error(f"Lost LISTEN connection, reconnecting: {e}")
+                self._close_listener()
+                self._connect_listener()
+                return
+
+    def run(self):
+        self.install_signal_handlers()
+        self._connect_listener()
+        self.logger.info("Pipeline worker started.")
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.submit_pending()
+                except Exception as e:
+                    self.logger.error(f"Failed to fetch pending PDFs: {e}")
+                self.wait_for_work()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self._close_listener()
+        # Running PDFs finish; queued ones are cancelled and their claims handed back
+        self.pdf_executor.shutdown(wait=True, cancel_futures=True)
+        self.image_executor.shutdown(wait=True)
+        self.text_executor.shutdown(wait=True)
+        with self._lock:
+            cancelled = list(self._in_flight)
+            self._in_flight.clear()
+        if cancelled:
+            try:
+                self.db_manager.release_pdf_claims(cancelled, refund_attempt=True)
+            except Exception as e:
+                self.logger.error(f"Could not release {len(cancelled)} claims on shutdown, their lease will expire: {e}")
+        self.logger.info("Pipeline worker stopped.")
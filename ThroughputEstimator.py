@@ -0,0 +1,122 @@
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from Logger import LoggerManager
+from PDFBuffer import PDFBuffer
+from image_text_extractor import save_pdf_page_as_image, iter_text_by_page
+
+
+class ThroughputEstimator:
+    """
+    Dry run of the pre-upload stages over a sample of a local corpus.
+
+    Runs page counting, rendering, PNG encoding and text extraction on a
+    random sample with the given worker count, without touching GCS or the
+    DB, and projects pages/sec, wall time and GCS bytes for the whole folder.
+    PDFs over max_allowed_page are counted as uploaded but not rendered,
+    matching what the pipeline does with them.
+    """
+
+    def __init__(self, max_workers=4, sample_size=20, dpi=100, batch_size=100, max_allowed_page=20, seed=None):
+        self.logger = LoggerManager().get_logger(self.__class__.__name__)
+        self.max_workers = max_workers
+        self.sample_size = sample_size
+        self.dpi = dpi
+        self.batch_size = batch_size
+        self.max_allowed_page = max_allowed_page
+        self.seed = seed
+
+    def _measure_pdf(self, pdf_path):
+        image_bytes = 0
+        rendered_pages = 0
+        text_chars = 0
+        with PDFBuffer(pdf_path) as pdf_buffer:
+            page_count = pdf_buffer.page_count or 0
+            if page_count and page_count <= self.max_allowed_page:
+                for image_batch in save_pdf_page_as_image(
+                        pdf_path, dpi=self.dpi, batch_size=self.batch_size, page_count=page_count):
+                    for image_data in image_batch:
+                        encoded = BytesIO()
+                        image_data['payload'].save(encoded, format="PNG")
+                        image_bytes += encoded.tell()
+                        rendered_pages += 1
+                for page in iter_text_by_page(Path(pdf_path), pdf_buffer=pdf_buffer):
+                    text_chars += len(page.text)
+            pdf_bytes = pdf_buffer.size
+
+        return {
+            'pdf_bytes': pdf_bytes,
+            'page_count': page_count,
+            'rendered_pages': rendered_pages,
+            'image_bytes': image_bytes,
+            'text_chars': text_chars,
+        }
+
+    def estimate(self, folder_path):
+        """
+        Returns:
+            dict: Sample measurements and corpus projections, or None if the folder has no PDFs.
+        """
+        corpus = []
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".pdf"):
+                    corpus.append((entry.path, entry.stat().st_size))
+        if not corpus:
+            self.logger.warning(f"No PDFs found in {folder_path}.")
+            return None
+
+        sample = random.Random(self.seed).sample(corpus, min(self.sample_size, len(corpus)))
+        self.logger.info(
+            f"Dry run: sampling {len(sample)} of {len(corpus)} PDFs with {self.max_workers} workers.")
+
+        results = []
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._measure_pdf, path): path for path, _ in sample}
+            for future, path in futures.items():
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    self.logger.error(f"Dry run failed for {path}: {e}")
+        sample_seconds = time.perf_counter() - started
+
+        if not results:
+            self.logger.error("Dry run could not process any sampled PDF.")
+            return None
+
+        sample_pdf_bytes = sum(r['pdf_bytes'] for r in results)
+        sample_pages = sum(r['page_count'] for r in results)
+        sample_rendered = sum(r['rendered_pages'] for r in results)
+        sample_image_bytes = sum(r['image_bytes'] for r in results)
+        corpus_pdf_bytes = sum(size for _, size in corpus)
+
+        # Scale by bytes rather than file count so a few huge files in the sample don't skew it
+        scale = corpus_pdf_bytes / sample_pdf_bytes if sample_pdf_bytes else len(corpus) / len(results)
+        projected_pages = sample_pages * scale
+        projected_rendered = sample_rendered * scale
+        pages_per_second = sample_rendered / sample_seconds if sample_seconds else 0.0
+        projected_image_bytes = sample_image_bytes * scale
+
+        report = {
+            'workers': self.max_workers,
+            'corpus_files': len(corpus),
+            'sampled_files': len(results),
+            'sample_seconds': sample_seconds,
+            'pages_per_second': pages_per_second,
+            'projected_pages': projected_pages,
+            'projected_rendered_pages': projected_rendered,
+            'projected_wall_seconds': projected_rendered / pages_per_second if pages_per_second else None,
+            'projected_pdf_bytes': corpus_pdf_bytes,
+            'projected_image_bytes': projected_image_bytes,
+            'projected_total_bytes': corpus_pdf_bytes + projected_image_bytes,
+        }
+        wall = report['projected_wall_seconds']
+        self.logger.info(
+            f"Dry run estimate: {pages_per_second:.2f} pages/sec with {self.max_workers} workers, "
+            f"~{projected_pages:.0f} pages, ~{report['projected_total_bytes'] / 1024 ** 3:.2f} GiB to GCS, "
+            f"~{(wall or 0) / 3600:.2f} h wall time (pre-upload stages only).")
+        return report
@@ -28,16 +28,26 @@ def count_pdf_pages(pdf_path):
     
 
 
-def extract_text_by_page(pdf_path: Path):
+class PageText:
+    """Extracted text of one page; slotted since text-heavy PDFs yield many of these."""
+    __slots__ = ('page_index', 'text')
+
+    def __init__(self, page_index, text):
+        self.page_index = page_index
+        self.text = text
+
+
+def iter_text_by_page(pdf_path: Path, pdf_buffer=None):
     """
-    Extracts text from each page of the given PDF using pdfminer.
-    If pdfminer fails (e.g., due to encryption), falls back to using pdfplumber.
+    Yields the text of each page of the given PDF as soon as it is parsed, using pdfminer.
+    If pdfminer fails on a page (e.g., due to encryption), falls back to pdfplumber for that page.
 
     Args:
         pdf_path (Path): The path to the PDF file.
+        pdf_buffer (PDFBuffer, optional): Already opened PDF to read from instead of pdf_path.
 
-    Returns:
-        list of dict: A list where each dictionary contains 'file_id' (int) and 'payload' (str) for each page.
+    Yields:
+        PageText: 0-based page index and cleaned text of each page.
     """
     resource_manager = PDFResourceManager()
     output_string = StringIO()
@@ -45,10 +55,11 @@ def extract_text_by_page(pdf_path: Path):
     device = TextConverter(resource_manager, output_string, laparams=laparams)
     interpreter = PDFPageInterpreter(resource_manager, device)
 
-    page_text_dict_list = []
+    def open_pdf():
+        return pdf_buffer.reader() if pdf_buffer is not None else open(pdf_path, 'rb')
 
     try:
-        with open(pdf_path, 'rb') as pdf_file:
+        with open_pdf() as pdf_file:
             for page_number, page in enumerate(PDFPage.get_pages(pdf_file, check_extractable=False), 1):
                 try:
                     output_string.truncate(0)
@@ -57,56 +68,24 @@ def extract_text_by_page(pdf_path: Path):
                     page_text = output_string.getvalue()
                     # Clean the extracted text
                     page_text = page_text.replace("\x00", "").encode('utf-8', errors='replace').decode('utf-8')
-
-                    page_text_dict_list.append({
-                        'file_id':( page_number - 1,),  # Changed from tuple to integer
-                        'payload': page_text
-                    })
                 except Exception as page_e:
                     logger.error(f"Error extracting text from page {page_number} using pdfminer: {page_e}")
                     # Attempt to extract text using pdfplumber for this specific page
                     try:
-                        with pdfplumber.open(pdf_path) as pdf:
+                        # pdfplumber does not close a stream it is given
+                        with open_pdf() as fallback_file, pdfplumber.open(fallback_file) as pdf:
                             page_plumber = pdf.pages[page_number - 1]
-                            text = page_plumber.extract_text() or ""
-                            page_text_dict_list.append({
-                                'file_id':( page_number - 1,),  # Integer
-                                'payload': text
-                            })
+                            page_text = page_plumber.extract_text() or ""
                             logger.info(f"Successfully extracted text from page {page_number} using pdfplumber.")
                     except Exception as plumber_e:
                         logger.error(f"Failed to extract text from page {page_number} using pdfplumber: {plumber_e}")
-                        # Append empty payload or handle as needed
-                        page_text_dict_list.append({
-                            'file_id': (page_number - 1,),
-                            'payload': ""
-                        })
+                        # Empty payload so the page still gets marked done
+                        page_text = ""
+
+                yield PageText(page_number - 1, page_text)
     except Exception as e:
         logger.exception(f"An error occurred while processing {pdf_path}: {e}")
     finally:
         # Clean up resources
         device.close()
         output_string.close()
-
-    return page_text_dict_list
-
-
-# Function to save pdf page to image
-def save_pdf_page_as_image(pdf_path, dpi:int=200, batch_size:int=100):
-
-    page_count = count_pdf_pages(pdf_path=pdf_path)
-    logger.info(f"page count for pdf {pdf_path}: {page_count}")
-
-    # Get list of pages to save as image
-    page_index_to_process = list(range(page_count))
-
-    if not batch_size:
-        batch_size = page_count
-
-    for i in range(0,len(page_index_to_process), batch_size):
-        batch_index = page_index_to_process[i: i+batch_size]
-        image_list = convert_from_path(pdf_path, dpi=dpi, first_page=batch_index[0]+1, last_page=batch_index[-1]+1)
-
-        data_list = [{'file_id':(page_index,),'payload':img} for page_index,img in zip(batch_index, image_list)]
-
-        yield data_list
@@ -1,45 +1,58 @@
-import os
 from datetime import datetime
 from DBManager import DBManager
 from GCSManager import GCSManager
 from DriveManager import DriveManager
+from LocalFolderManager import LocalFolderManager
 from PDFProcessor import PDFProcessor
+from PDFBuffer import PDFBuffer
+from PipelineWorker import PipelineWorker
+from BackfillRunner import BackfillRunner
+from ThroughputEstimator import ThroughputEstimator
 from slugify import slugify
-from utils import create_connection_string_from_json
+from utils import create_connection_string_from_json, get_local_pdf_path
 from Logger import LoggerManager
 
 logger = LoggerManager().get_logger("main")
 
-def main(pdf_file_path, db_manager, gcs_manager):
+def main(pdf_file_path, db_manager, gcs_manager, pdf_buffer=None):
     try:
         # Initialize PDF Processor
         pdf_processor = PDFProcessor(db_manager, gcs_manager)
 
         # Process and upload the PDF
-        pdf_processor.process_and_upload_pdf(pdf_path=pdf_file_path, dpi=100, batch_size=100)
+        pdf_processor.process_and_upload_pdf(pdf_path=pdf_file_path, dpi=100, batch_size=100, pdf_buffer=pdf_buffer)
 
         logger.info(f"PDF processing completed successfully for {pdf_file_path}")
+        return True
 
     except Exception as e:
         logger.error(f"An error occurred while processing {pdf_file_path}: {e}")
+        return False
 
-def process_pending_pdfs(db_manager, gcs_manager, base_path,temp_path, batch_size=100):
-    # Fetch PDFs with 'pending' status
-    pending_pdfs = db_manager.get_pending_pdfs()
-
-    if not pending_pdfs:
-        logger.info("No pending PDFs to process.")
-        return
+def process_claimed_pdf(pdf, pdf_file_path, db_manager, gcs_manager, pdf_buffer=None):
+    """Processes a PDF claimed with claim_pending_pdfs and hands the claim back if it fails."""
+    if not main(pdf_file_path, db_manager, gcs_manager, pdf_buffer=pdf_buffer):
+        db_manager.release_pdf_claims([pdf.pdf_file_id])
 
-    # Process PDFs in batches
-    for pdf_batch in batch_iterator(pending_pdfs, batch_size):
+def process_pending_pdfs(db_manager, gcs_manager, base_path,temp_path, batch_size=100):
+    # Claim PDFs with 'pending' status in batches, shortest job first, so
+    # concurrent runs and PipelineWorkers never process the same row
+    processed = 0
+    while True:
+        pdf_batch = db_manager.claim_pending_pdfs(limit=batch_size)
+        if not pdf_batch:
+            break
         logger.info(f"Processing a batch of {len(pdf_batch)} PDFs.")
 
         for pdf in pdf_batch:
-            pdf_file_path = os.path.join(temp_path, pdf.pdf_file_name) if 'drive.google.com' in pdf.pdf_file_path else pdf.pdf_file_path
+            pdf_file_path = get_local_pdf_path(pdf, temp_path)
             logger.info(f"Started processing for PDF: {pdf.pdf_file_name}")
-            main(pdf_file_path, db_manager, gcs_manager)
+            process_claimed_pdf(pdf, pdf_file_path, db_manager, gcs_manager)
             logger.info(f"Processing completed for PDF: {pdf.pdf_file_name}")
+        processed += len(pdf_batch)
+
+    if not processed:
+        logger.info("No pending PDFs to process.")
 
 def batch_iterator(iterable, batch_size):
     """Yield successive batches from iterable."""
@@ -52,69 +65,127 @@ def batch_iterator(iterable, batch_size):
     if batch:
         yield batch
 
-def insert_and_process_in_batches(files, db_manager, gcs_manager, from_drive=False, base_path="",temp_path='', batch_size=15):
+def insert_and_process_in_batches(files, db_manager, gcs_manager, from_drive=False, base_path="",temp_path='', batch_size=15, ingest_only=False):
     for file_batch in batch_iterator(files, batch_size):
         inserted_pdfs = []
-
-        for file_info in file_batch:
-            filename, file_path, file_url = file_info
-            print(filename,file_path,file_url)
-            pdf_uuid = db_manager.get_pdf_uuid(filename)
-
-            if not pdf_uuid:
-                logger.info(f"Inserting PDF {filename} into DB and uploading to GCS.")
-                try:
-                    upload_pdf_file_name = slugify(filename)
-                    upload_pdf_file_name.replace('-pdf','.pdf')
-                    with open(file_path, "rb") as pdf_file_data:
-                        public_uri = gcs_manager.upload_pdf(pdf_file_data, upload_pdf_file_name)
-
-                    db_manager.insert_pdf_files(
-                        filename=filename,
-                        pdf_file_path=file_path,
-                        pdf_public_url=public_uri,
-                        pdf_gdrive_url=file_url if from_drive else None
-                    )
-                    inserted_pdfs.append((filename, file_path, file_url))
-                except Exception as e:
-                    logger.error(f"Error uploading/inserting PDF {filename}: {e}")
-            else:
-                logger.info(f"PDF {filename} already exists in DB. Skipping.")
-
-        # Process the inserted PDFs for this batch
-        for filename, file_path, file_url in inserted_pdfs:
-            print(filename, file_path, file_url)
-            logger.info(f"Started processing PDF: {filename}")
-            logger.info(f"fetching  PDF status: {filename}")
-            status=db_manager.get_pdf_status(filename)
-            if status=='Pending':
-                main(file_path, db_manager, gcs_manager)
-                logger.info(f"Finished processing PDF: {filename}")
-            else:
-                logger.info(f"Skipping PDF: {filename}")
-        
+        existing_statuses = db_manager.get_pdf_statuses(filename for filename, _, _ in file_batch)
+        # Each inserted PDF is read from disk once and the mapping reused for processing
+        pdf_buffers = {}
+
+        try:
+            for file_info in file_batch:
+                filename, file_path, file_url = file_info
+                print(filename,file_path,file_url)
+
+                if filename not in existing_statuses:
+                    logger.info(f"Inserting PDF {filename} into DB and uploading to GCS.")
+                    pdf_buffer = None
+                    try:
+                        upload_pdf_file_name = slugify(filename)
+                        upload_pdf_file_name.replace('-pdf','.pdf')
+                        pdf_buffer = PDFBuffer(file_path)
+                        public_uri = gcs_manager.upload_pdf(pdf_buffer.reader(), upload_pdf_file_name)
+
+                        db_manager.insert_pdf_files(
+                            filename=filename,
+                            pdf_file_path=file_path,
+                            pdf_public_url=public_uri,
+                            pdf_gdrive_url=file_url if from_drive else None,
+                            pdf_buffer=pdf_buffer
+                        )
+                        inserted_pdfs.append((filename, file_path, file_url))
+                        if not ingest_only:
+                            pdf_buffers[filename] = pdf_buffer
+                            pdf_buffer = None
+                    except Exception as e:
+                        logger.error(f"Error uploading/inserting PDF {filename}: {e}")
+                    finally:
+                        if pdf_buffer is not None:
+                            pdf_buffer.close()
+                else:
+                    logger.info(f"PDF {filename} already exists in DB. Skipping.")
+
+            if ingest_only:
+                # A PipelineWorker picks these up from the Pending NOTIFY
+                continue
+
+            # Process the inserted PDFs for this batch that are still Pending and
+            # not already taken by a PipelineWorker
+            claimed = {
+                pdf.pdf_file_name: pdf
+                for pdf in db_manager.claim_pending_pdfs(pdf_file_names=[filename for filename, _, _ in inserted_pdfs])
+            } if inserted_pdfs else {}
+            for filename, file_path, file_url in inserted_pdfs:
+                print(filename, file_path, file_url)
+                logger.info(f"Started processing PDF: {filename}")
+                pdf = claimed.get(filename)
+                if pdf is not None:
+                    process_claimed_pdf(pdf, file_path, db_manager, gcs_manager, pdf_buffer=pdf_buffers.get(filename))
+                    logger.info(f"Finished processing PDF: {filename}")
+                else:
+                    logger.info(f"Skipping PDF: {filename}")
+        finally:
+            for pdf_buffer in pdf_buffers.values():
+                pdf_buffer.close()
+
+    if ingest_only:
+        return
     logger.info(f"Processing pending PDFs:")
     process_pending_pdfs(db_manager, gcs_manager, base_path,temp_path, batch_size=100)
 
-def process_pdfs(folder_path=None, drive_manager=None, db_url=None, image_bucket_name=None, service_account_json_path=None, pdf_bucket_name=None,temp_path=None,max_allowed_page=20):
-    db_manager = DBManager(db_url,max_allowed_page)
+def process_pdfs(folder_path=None, drive_manager=None, db_url=None, image_bucket_name=None, service_account_json_path=None, pdf_bucket_name=None,temp_path=None,max_allowed_page=20,manifest_path=None,ingest_only=False,replica_urls=None,dry_run=False,dry_run_workers=4,dry_run_sample_size=20):
+    if dry_run:
+        # Size the run without touching GCS or the DB
+        if not folder_path:
+            logger.error("Dry run needs a local folder_path to sample from.")
+            return None
+        estimator = ThroughputEstimator(max_workers=dry_run_workers, sample_size=dry_run_sample_size, dpi=100, batch_size=100, max_allowed_page=max_allowed_page)
+        return estimator.estimate(folder_path)
+
+    db_manager = DBManager(db_url,max_allowed_page,replica_urls=replica_urls)
     logger.info("DB Manager initialized")
     gcs_manager = GCSManager(service_account_json_path, image_bucket_name, pdf_bucket_name)
     logger.info("GCS Manager initialized")
 
     if folder_path:
         logger.info("Processing files from local folder.")
-        local_files = [(file, os.path.join(folder_path, file), "") for file in os.listdir(folder_path) if file.endswith(".pdf")]
-        insert_and_process_in_batches(local_files, db_manager, gcs_manager, from_drive=False, base_path=folder_path,temp_path=temp_path)
+        folder_manager = LocalFolderManager(folder_path, manifest_path=manifest_path, state_dir=temp_path)
+        local_files = folder_manager.check_new_files()
+        try:
+            insert_and_process_in_batches(local_files, db_manager, gcs_manager, from_drive=False, base_path=folder_path,temp_path=temp_path, ingest_only=ingest_only)
+        finally:
+            folder_manager.commit_seen(db_manager)
 
     elif drive_manager:
         logger.info("Processing files from Google Drive.")
         drive_files = drive_manager.check_and_download_new_files(db_manager)
-        insert_and_process_in_batches(drive_files, db_manager, gcs_manager, from_drive=True, base_path=folder_path,temp_path=temp_path)
+        try:
+            insert_and_process_in_batches(drive_files, db_manager, gcs_manager, from_drive=True, base_path=folder_path,temp_path=temp_path, ingest_only=ingest_only)
+        finally:
+            drive_manager.commit_sync(db_manager)
 
     else:
         logger.error("No source specified for PDFs. Please provide either folder_path or drive_manager.")
 
+def run_daemon(db_url=None, image_bucket_name=None, service_account_json_path=None, pdf_bucket_name=None, temp_path=None, max_allowed_page=20, max_workers=4):
+    """Processes Pending PDFs continuously until SIGTERM, see PipelineWorker."""
+    db_manager = DBManager(db_url,max_allowed_page)
+    logger.info("DB Manager initialized")
+    gcs_manager = GCSManager(service_account_json_path, image_bucket_name, pdf_bucket_name)
+    logger.info("GCS Manager initialized")
+
+    worker = PipelineWorker(db_manager, gcs_manager, temp_path, max_workers=max_workers, dpi=100, batch_size=100)
+    worker.run()
+
+def backfill_pdfs(stages, pdf_file_names=None, db_url=None, image_bucket_name=None, service_account_json_path=None, pdf_bucket_name=None, temp_path=None, max_allowed_page=20, max_workers=8, replica_urls=None):
+    """Reruns only the given stages ('text', 'images') over processed PDFs, see BackfillRunner."""
+    db_manager = DBManager(db_url,max_allowed_page,replica_urls=replica_urls)
+    logger.info("DB Manager initialized")
+    gcs_manager = GCSManager(service_account_json_path, image_bucket_name, pdf_bucket_name)
+    logger.info("GCS Manager initialized")
+
+    backfill_runner = BackfillRunner(db_manager, gcs_manager, temp_path=temp_path, max_workers=max_workers, dpi=100, batch_size=100)
+    return backfill_runner.run(stages, pdf_file_names=pdf_file_names)
 
 if __name__ == "__main__":
 
@@ -131,8 +202,11 @@ if __name__ == "__main__":
     # folder_path = None # Leave as None if you want to process from Google Drive
     drive_folder_id = '1fI7Zxxxxxxxx-xxxxxxxxxxxxDv'
     tmp_folder_path = r"G:\Mini_projects\datasheet_pipeline\tmp"
+    run_as_daemon = False  # Keep processing Pending PDFs until SIGTERM; safe alongside normal runs, rows are claimed
     
-    if folder_path:
+    if run_as_daemon:
+        run_daemon(db_url=postgres_db_url, pdf_bucket_name=datasheet_pdf_bucket_name,image_bucket_name=datasheet_image_bucket_name, service_account_json_path=service_account_json_path,max_allowed_page=max_allowed_page,temp_path=tmp_folder_path)
+    elif folder_path:
         # Process from local folder
         process_pdfs(folder_path=folder_path, db_url=postgres_db_url, pdf_bucket_name=datasheet_pdf_bucket_name,image_bucket_name=datasheet_image_bucket_name, service_account_json_path=service_account_json_path,max_allowed_page=max_allowed_page,temp_path=tmp_folder_path)
     # else:
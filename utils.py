@@ -1,4 +1,5 @@
 import json
+import os
 import urllib.parse
 
 
@@ -30,3 +31,15 @@ def create_connection_string_from_json(file_path):
 
     return f"postgresql://{username}:{password}@{host}:{port}/{database}"
 
+
+
+def get_local_pdf_path(pdf_record, temp_path):
+    """
+    Returns where a PDFFile row's source file lives on disk.
+
+    Drive-sourced rows store the Drive URL in pdf_file_path and are downloaded
+    into temp_path under their file name.
+    """
+    if 'drive.google.com' in pdf_record.pdf_file_path:
+        return os.path.join(temp_path, pdf_record.pdf_file_name)
+    return pdf_record.pdf_file_path